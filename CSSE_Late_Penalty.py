@@ -2,116 +2,216 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+import functools
 import io
 import math
+import re
 from typing import Dict, Set, Optional, Tuple
 
 # Set page config
 st.set_page_config(page_title="Late Penalty Calculator", page_icon="📊", layout="wide")
 
+# Formats to try, grouped by the shape of the date part so a cheap regex
+# match can dispatch straight to the right family instead of eating a
+# ValueError per wrong format
+_DMY_SLASH_FORMATS = [
+    '%d/%m/%Y %I:%M:%S %p',  # 18/04/2025 11:59:00 PM
+    '%d/%m/%Y %H:%M:%S',     # DD/MM/YYYY HH:MM:SS
+    '%d/%m/%Y %I:%M %p',     # DD/MM/YYYY HH:MM AM/PM
+    '%d/%m/%Y %H:%M',        # DD/MM/YYYY HH:MM
+    '%d/%m/%Y',              # DD/MM/YYYY
+]
+_DMY_DASH_FORMATS = [
+    '%d-%m-%Y, %H:%M:%S',    # 21-04-2025, 23:59:00
+    '%d-%m-%Y %H:%M:%S',     # dd-04-2025 23:59:00
+    '%d-%m-%Y, %H:%M',       # dd-04-2025, 23:59
+    '%d-%m-%Y %H:%M',        # dd-04-2025 23:59
+    '%d-%m-%Y',              # dd-04-2025
+]
+_YMD_DASH_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',     # YYYY-MM-DD HH:MM:SS
+    '%Y-%m-%d %H:%M',        # YYYY-MM-DD HH:MM
+    '%Y-%m-%d',              # YYYY-MM-DD
+]
+_FORMATS = _DMY_SLASH_FORMATS + _DMY_DASH_FORMATS + _YMD_DASH_FORMATS
+
+# ciso8601 parses ISO-shaped timestamps in pure C, far faster than strptime
+try:
+    import ciso8601
+    _parse_iso = ciso8601.parse_datetime
+except ImportError:
+    _parse_iso = None
+
+_DMY_SLASH = re.compile(r'^\d{1,2}/\d{1,2}/\d{4}')
+_DMY_DASH = re.compile(r'^\d{1,2}-\d{1,2}-\d{4}')
+_YMD_DASH = re.compile(r'^\d{4}-\d{1,2}-\d{1,2}')
+
+def _candidate_formats(date_str: str):
+    """Narrow the formats to try based on the shape of the date part"""
+    if _DMY_SLASH.match(date_str):
+        return _DMY_SLASH_FORMATS
+    if _DMY_DASH.match(date_str):
+        return _DMY_DASH_FORMATS
+    if _YMD_DASH.match(date_str):
+        return _YMD_DASH_FORMATS
+    return _FORMATS
+
+# Formats without a time component get 23:59:00 appended
+_DATE_ONLY_FORMATS = {'%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d'}
+
+# Index of the last format that matched; a whole column usually shares one
+# format, so trying it first cuts the strptime attempts to ~1 per row
+_hot_fmt = [0]
+
 def parse_datetime(date_str):
     """Parse date strings in various formats"""
     if pd.isna(date_str):
         return None
-    
+
     # Convert to string in case we get a different data type
-    date_str = str(date_str).strip()
-    
-    # List of formats to try
-    formats = [
-        '%d/%m/%Y %I:%M:%S %p',  # 18/04/2025 11:59:00 PM
-        '%d/%m/%Y %H:%M:%S',     # DD/MM/YYYY HH:MM:SS
-        '%d/%m/%Y %I:%M %p',     # DD/MM/YYYY HH:MM AM/PM
-        '%d/%m/%Y %H:%M',        # DD/MM/YYYY HH:MM
-        '%d/%m/%Y',              # DD/MM/YYYY
-        '%d-%m-%Y, %H:%M:%S',    # 21-04-2025, 23:59:00
-        '%d-%m-%Y %H:%M:%S',     # dd-04-2025 23:59:00
-        '%d-%m-%Y, %H:%M',       # dd-04-2025, 23:59
-        '%d-%m-%Y %H:%M',        # dd-04-2025 23:59
-        '%d-%m-%Y',              # dd-04-2025
-        '%Y-%m-%d %H:%M:%S',     # YYYY-MM-DD HH:MM:SS
-        '%Y-%m-%d %H:%M',        # YYYY-MM-DD HH:MM
-        '%Y-%m-%d',              # YYYY-MM-DD
-    ]
-    
-    # Try each format
-    for fmt in formats:
+    return _parse_datetime_cached(str(date_str).strip())
+
+@functools.lru_cache(maxsize=4096)
+def _parse_datetime_cached(date_str: str):
+    """Parse a single cleaned date string, caching exact duplicates"""
+    # Narrow the candidates by shape, then try the last successful format first
+    candidates = _candidate_formats(date_str)
+
+    # ISO-shaped inputs get the C parser when ciso8601 is installed
+    if candidates is _YMD_DASH_FORMATS and _parse_iso is not None:
         try:
-            dt = datetime.strptime(date_str, fmt)
-            # If the format doesn't include time, set it to 23:59:00
-            if fmt in ['%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d']:
+            dt = _parse_iso(date_str.replace(' ', 'T', 1))
+        except ValueError:
+            pass
+        else:
+            # If the input has no time part, set it to 23:59:00
+            if len(date_str) <= 10:
                 dt = dt.replace(hour=23, minute=59, second=0)
             return dt
+
+    hot = _FORMATS[_hot_fmt[0]]
+    if hot in candidates and candidates[0] != hot:
+        candidates = [hot] + [fmt for fmt in candidates if fmt != hot]
+    for fmt in candidates:
+        try:
+            dt = datetime.strptime(date_str, fmt)
         except ValueError:
             continue
-    
+        _hot_fmt[0] = _FORMATS.index(fmt)
+        # If the format doesn't include time, set it to 23:59:00
+        if fmt in _DATE_ONLY_FORMATS:
+            dt = dt.replace(hour=23, minute=59, second=0)
+        return dt
+
     # Try pandas parser as last resort
     try:
         return pd.to_datetime(date_str).to_pydatetime()
     except:
         pass
-        
+
     return None
 
+# Penalty bucket edges (inclusive upper bounds, in hours) and the matching
+# penalty tables, built once at import so every caller shares them
+_REG_EDGES = np.array([0, 48, 72, 96, 120, 144, 168], dtype=np.float64)
+_REG_VAL = np.array([0, 0, 15, 20, 25, 30, 35, 100], dtype=np.int16)
+_SPEC_EDGES = np.array([0, 24, 48, 72, 96, 120, 144, 168], dtype=np.float64)
+_SPEC_VAL = np.array([0, 5, 10, 15, 20, 25, 30, 35, 100], dtype=np.int16)
+
+# Compile the branchy scalar version to native code when numba is installed;
+# scalar callers in tight loops then skip Python dispatch entirely
+try:
+    from numba import njit
+except ImportError:
+    _late_penalty_nb = None
+else:
+    @njit(cache=True)
+    def _late_penalty_nb(hours_late: float, has_special_consideration: bool) -> int:
+        if hours_late <= 0:
+            return 0
+        if not has_special_consideration:
+            if hours_late <= 48:
+                return 0
+            elif hours_late <= 72:
+                return 15
+            elif hours_late <= 96:
+                return 20
+            elif hours_late <= 120:
+                return 25
+            elif hours_late <= 144:
+                return 30
+            elif hours_late <= 168:
+                return 35
+            else:
+                return 100
+        else:
+            if hours_late <= 24:
+                return 5
+            elif hours_late <= 48:
+                return 10
+            elif hours_late <= 72:
+                return 15
+            elif hours_late <= 96:
+                return 20
+            elif hours_late <= 120:
+                return 25
+            elif hours_late <= 144:
+                return 30
+            elif hours_late <= 168:
+                return 35
+            else:
+                return 100
+
 def calculate_late_penalty(hours_late: float, has_special_consideration: bool = False) -> int:
     """
     Calculate late penalty based on hours late and special consideration status
-    
+
     Parameters:
     - hours_late: Number of hours late
     - has_special_consideration: Whether student has extension/UAAP
-    
+
     Returns:
     - Penalty percentage (0-35 or 100)
     """
-    if hours_late <= 0:
-        return 0
-    
-    # Regular students
-    if not has_special_consideration:
-        if hours_late <= 48:
-            return 0
-        elif hours_late <= 72:
-            return 15
-        elif hours_late <= 96:
-            return 20
-        elif hours_late <= 120:
-            return 25
-        elif hours_late <= 144:
-            return 30
-        elif hours_late <= 168:
-            return 35
-        else:
-            return 100
-    
-    # Special consideration students (extension/UAAP)
-    else:
-        if hours_late <= 24:
-            return 5
-        elif hours_late <= 48:
-            return 10
-        elif hours_late <= 72:
-            return 15
-        elif hours_late <= 96:
-            return 20
-        elif hours_late <= 120:
-            return 25
-        elif hours_late <= 144:
-            return 30
-        elif hours_late <= 168:
-            return 35
-        else:
-            return 100
+    if _late_penalty_nb is not None:
+        return _late_penalty_nb(float(hours_late), bool(has_special_consideration))
+    if has_special_consideration:
+        return int(_SPEC_VAL[np.searchsorted(_SPEC_EDGES, hours_late, side='left')])
+    return int(_REG_VAL[np.searchsorted(_REG_EDGES, hours_late, side='left')])
+
+# Columns actually consumed from each upload; grade-history exports are wide,
+# so skipping the rest cuts parse time and memory proportionally
+_SUBMISSION_COLS = {'Last Edited by: Username', 'Attempt Activity', 'Last Edited by: Name'}
+_EXTENSION_COLS = {'Student ID', 'Extension'}
 
+def _read_upload(file, wanted: Set[str]) -> pd.DataFrame:
+    """
+    Read an uploaded CSV or Excel file, keeping only the wanted columns and
+    preferring the faster pyarrow/calamine engines when they are installed
+    """
+    if file.name.endswith('.csv'):
+        # Sniff the header first; the pyarrow engine needs usecols as a list
+        header = pd.read_csv(file, nrows=0).columns
+        file.seek(0)
+        cols = [col for col in header if col in wanted] or None
+        try:
+            return pd.read_csv(file, engine='pyarrow', usecols=cols)
+        except (ImportError, ValueError):
+            file.seek(0)
+            return pd.read_csv(file, usecols=cols)
+    try:
+        return pd.read_excel(file, engine='calamine', usecols=lambda col: col in wanted)
+    except (ImportError, ValueError):
+        file.seek(0)
+        return pd.read_excel(file, usecols=lambda col: col in wanted)
+
+@st.cache_data(show_spinner=False)
 def process_submission_file(file) -> pd.DataFrame:
     """Process the submission detail file (CSV or Excel)"""
     try:
         # Determine file type and read accordingly
-        if file.name.endswith('.csv'):
-            df = pd.read_csv(file)
-        else:
-            df = pd.read_excel(file)
-        
+        df = _read_upload(file, _SUBMISSION_COLS)
+
         # Check for required columns
         required_cols = ['Last Edited by: Username', 'Attempt Activity']
         missing_cols = [col for col in required_cols if col not in df.columns]
@@ -125,6 +225,7 @@ def process_submission_file(file) -> pd.DataFrame:
         st.error(f"Error reading submission file: {e}")
         return None
 
+@st.cache_data(show_spinner=False)
 def process_extension_file(file) -> Tuple[Set[str], Dict[str, datetime]]:
     """
     Process the extension/UAAP file
@@ -135,11 +236,8 @@ def process_extension_file(file) -> Tuple[Set[str], Dict[str, datetime]]:
     
     try:
         # Determine file type and read accordingly
-        if file.name.endswith('.csv'):
-            df = pd.read_csv(file)
-        else:
-            df = pd.read_excel(file)
-        
+        df = _read_upload(file, _EXTENSION_COLS)
+
         # Check for Student ID column
         if 'Student ID' not in df.columns:
             st.error("Missing 'Student ID' column in extension file")
@@ -153,18 +251,26 @@ def process_extension_file(file) -> Tuple[Set[str], Dict[str, datetime]]:
         df = df[df['Student ID'].str.len() >= 8]
         
         # Add all remaining students to special consideration set
-        special_students = set(df['Student ID'].tolist())
+        # (straight from the numpy array, skipping the list intermediate)
+        special_students = frozenset(df['Student ID'].to_numpy(copy=False))
         
         # Check if there's an Extension column for custom deadlines
-        if 'Extension' in df.columns:
-            for _, row in df.iterrows():
-                student_id = row['Student ID']
-                extension_date = row['Extension']
-                
-                if not pd.isna(extension_date):
-                    parsed_date = parse_datetime(str(extension_date))
-                    if parsed_date:
-                        special_deadlines[student_id] = parsed_date
+        if 'Extension' in df.columns and not df.empty:
+            ext = df['Extension']
+            cleaned = ext.astype(str).str.strip()
+            # The Instructions document extensions as %d/%m/%Y %H:%M:%S, so
+            # try that exact format first (fast C path) and only fall back to
+            # mixed-format inference for entries that don't match
+            parsed = pd.to_datetime(cleaned, format='%d/%m/%Y %H:%M:%S', errors='coerce')
+            stragglers = parsed.isna() & ext.notna()
+            if stragglers.any():
+                parsed[stragglers] = pd.to_datetime(
+                    cleaned[stragglers],
+                    format='mixed', dayfirst=True, cache=True, errors='coerce'
+                )
+            mask = ext.notna() & parsed.notna()
+            special_deadlines = dict(zip(df.loc[mask, 'Student ID'],
+                                         parsed[mask].dt.to_pydatetime()))
         
         return special_students, special_deadlines
         
@@ -172,70 +278,103 @@ def process_extension_file(file) -> Tuple[Set[str], Dict[str, datetime]]:
         st.error(f"Error reading extension file: {e}")
         return special_students, special_deadlines
 
-def process_data(submission_df: pd.DataFrame, 
-                deadline: datetime,
-                special_students: Set[str],
-                special_deadlines: Dict[str, datetime]) -> pd.DataFrame:
-    """Process submission data and calculate late penalties"""
-    
+@st.cache_data(show_spinner=False)
+def _prepare_final_submissions(submission_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parse submission times and reduce to each student's final submission.
+    Cached separately from the penalty math so tweaking the due date and
+    re-clicking Calculate doesn't re-parse the upload.
+    """
     # Filter out rows with missing critical data
     df = submission_df.dropna(subset=['Last Edited by: Username', 'Attempt Activity'])
-    
+
     # Convert Username to string
     df['Last Edited by: Username'] = df['Last Edited by: Username'].astype(str).str.strip()
-    
-    # Parse submission times
-    df['Parsed_Datetime'] = df['Attempt Activity'].apply(parse_datetime)
+
+    # Filter out student IDs that start with "00" or have less than 8 digits
+    # before parsing and grouping, so the heavy steps see fewer rows
+    uid = df['Last Edited by: Username']
+    df = df[(uid.str.len() >= 8) & (~uid.str.startswith('00'))]
+
+    # Nothing usable survived the filters; skip the heavy steps
+    if df.empty:
+        df['Parsed_Datetime'] = pd.Series(dtype='datetime64[ns]')
+        return df
+
+    # Usernames repeat heavily; Categorical lets the groupby hash integer
+    # codes instead of strings
+    df['Last Edited by: Username'] = df['Last Edited by: Username'].astype('category')
+
+    # Parse submission times in one vectorized pass (LMS exports share one
+    # format, so pandas' internal cache of unique strings does most of the work)
+    df['Parsed_Datetime'] = pd.to_datetime(
+        df['Attempt Activity'].astype(str).str.strip(),
+        format='mixed', dayfirst=True, cache=True, errors='coerce'
+    )
     df = df.dropna(subset=['Parsed_Datetime'])
-    
-    # Group by username and find the final submission
-    final_submissions = df.sort_values('Parsed_Datetime').groupby('Last Edited by: Username').last().reset_index()
-    
-    # Calculate hours late and penalties
-    results = []
-    
-    for _, row in final_submissions.iterrows():
-        student_id = row['Last Edited by: Username']
-        
-        # Filter out student IDs that start with "00" or have less than 8 digits
-        if student_id.startswith('00') or len(student_id) < 8:
-            continue
-            
-        submission_time = row['Parsed_Datetime']
-        
-        # Determine deadline for this student
-        if student_id in special_deadlines:
-            student_deadline = special_deadlines[student_id]
-        else:
-            student_deadline = deadline
-        
-        # Calculate hours late
-        if submission_time and student_deadline:
-            hours_late = (submission_time - student_deadline).total_seconds() / 3600
-            hours_late = max(0, hours_late)  # Can't be negative
-        else:
-            hours_late = 0
-        
-        # Check if student has special consideration
-        has_special = student_id in special_students
-        
-        # Calculate penalty
-        penalty = calculate_late_penalty(hours_late, has_special)
-        
-        # Create result record
-        result = {
-            'Student_ID': student_id,
-            'Student_Name': row.get('Last Edited by: Name', 'Unknown'),
-            'Submission_Time': row['Attempt Activity'],
-            'Hours_Late': round(hours_late, 2),
-            'Late_Penalty': f'{penalty}%',
-            'Deadline_Used': student_deadline.strftime('%d/%m/%Y %H:%M:%S'),
-            'Special_Consideration': 'Yes' if has_special else 'No'
-        }
-        
-        results.append(result)
-    
-    return pd.DataFrame(results)
+
+    # Group by username and find the final submission (idxmax avoids sorting
+    # the whole frame just to take one row per user)
+    return df.loc[
+        df.groupby('Last Edited by: Username', sort=False)['Parsed_Datetime'].idxmax()
+    ].reset_index(drop=True)
+
+def process_data(submission_df: pd.DataFrame,
+                deadline: datetime,
+                special_students: Set[str],
+                special_deadlines: Dict[str, datetime]) -> pd.DataFrame:
+    """Process submission data and calculate late penalties"""
+
+    final_submissions = _prepare_final_submissions(submission_df)
+
+    if final_submissions.empty:
+        return pd.DataFrame(columns=['Student_ID', 'Student_Name', 'Submission_Time',
+                                     'Hours_Late', 'Late_Penalty', 'Deadline_Used',
+                                     'Special_Consideration'])
+
+    student_ids = final_submissions['Last Edited by: Username']
+
+    # Determine each student's deadline (custom extension or the default)
+    deadlines = pd.to_datetime(student_ids.map(special_deadlines)).fillna(deadline)
+    deadlines_array = deadlines.values.astype('datetime64[s]')
+
+    # Calculate hours late as one datetime64 subtraction over the whole column
+    submitted = final_submissions['Parsed_Datetime'].values.astype('datetime64[s]')
+    hours_late = np.maximum(0, (submitted - deadlines_array).astype(np.int64) / 3600.0)
+
+    # Check which students have special consideration, comparing the
+    # categorical's integer codes rather than hashing strings
+    special_codes = student_ids.cat.categories.get_indexer(list(special_students))
+    is_special = np.isin(student_ids.cat.codes.values, special_codes[special_codes >= 0])
+
+    # Bucketize hours late into the shared penalty tables
+    penalty = np.where(is_special,
+                       _SPEC_VAL[np.searchsorted(_SPEC_EDGES, hours_late)],
+                       _REG_VAL[np.searchsorted(_REG_EDGES, hours_late)])
+
+    # Resolve the name column once
+    if 'Last Edited by: Name' in final_submissions.columns:
+        names = final_submissions['Last Edited by: Name'].values
+    else:
+        names = np.full(len(final_submissions), 'Unknown', dtype=object)
+
+    # Assemble the result DataFrame column-by-column
+    return pd.DataFrame({
+        'Student_ID': student_ids.values,
+        'Student_Name': names,
+        'Submission_Time': final_submissions['Attempt Activity'].values,
+        'Hours_Late': np.round(hours_late, 2),
+        'Late_Penalty': np.char.add(penalty.astype(str), '%'),
+        'Deadline_Used': pd.DatetimeIndex(deadlines_array).strftime('%d/%m/%Y %H:%M:%S'),
+        'Special_Consideration': np.where(is_special, 'Yes', 'No')
+    })
+
+@st.cache_data(show_spinner=False)
+def _results_to_csv_bytes(results_df: pd.DataFrame) -> bytes:
+    """Serialize results once per unique frame so repeated Download clicks reuse it"""
+    buf = io.BytesIO()
+    results_df.to_csv(buf, index=False)
+    return buf.getvalue()
 
 # Streamlit UI
 st.title("📊 Late Penalty Calculator")
@@ -350,17 +489,19 @@ if st.button("🚀 Calculate Late Penalties", type="primary"):
             st.dataframe(results_df, use_container_width=True)
             
             # Download button
-            csv = results_df.to_csv(index=False)
             st.download_button(
                 label="📥 Download Results as CSV",
-                data=csv,
+                data=_results_to_csv_bytes(results_df),
                 file_name=f"late_penalties_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
                 mime="text/csv"
             )
             
-            # Penalty distribution
+            # Penalty distribution (count on integers so 100% sorts after 35%,
+            # not lexicographically between 10% and 15%)
             st.subheader("📈 Penalty Distribution")
-            penalty_counts = results_df['Late_Penalty'].value_counts().sort_index()
+            penalty_counts = (results_df['Late_Penalty'].str.rstrip('%')
+                              .astype(int).value_counts().sort_index())
+            penalty_counts.index = penalty_counts.index.astype(str) + '%'
             st.bar_chart(penalty_counts)
 
 # Footer